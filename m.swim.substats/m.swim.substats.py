@@ -14,7 +14,7 @@
 #############################################################################
 
 #%Module
-#% description: Soil and Water Integrated Model (SWIM) preprocessor: subbasin statistics
+#% description: Soil and Water Integrated Model (SWIM) preprocessor: subbasin statistics, requires pandas (and pyproj to calculate lat).
 #%End
 
 #%Option
@@ -424,6 +424,18 @@
 #% label: Keep intermediate files (those named *__*)
 #%end
 
+#%Flag
+#% guisection: Optional
+#% key: m
+#% label: Mask the processing to the subbasins (not needed for the statistics)
+#%end
+
+#%Flag
+#% guisection: Optional
+#% key: r
+#% label: Recreate the subbasin raster even if an up-to-date subbasin__rast exists
+#%end
+
 #%Flag
 #% guisection: Optional
 #% key: v
@@ -433,13 +445,21 @@
 
 import sys
 import grass.script as grass
+from grass.script import array as garray
 import numpy as np
 import os
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 grun = grass.run_command
 gread= grass.read_command
 gm   = grass.message
 
+# optional jit compilation of the cell length kernel
+try:
+    import numba
+except ImportError:
+    numba = None
+
 # cautious Alpha implementation of the mswim abstraction package
 try:
     path = grass.utils.get_lib_path(modname='m.swim', libname='mswim')
@@ -493,13 +513,30 @@ class main:
                         grass.fatal('Not sure what to do with %s given in %sorder. No default value or raster given.' %(p,f))
 
 
-        # make rast from subbasin vector
-        self.subbasinrast='subbasin__rast'
-        grun('v.to.rast',input=self.subbasins,output=self.subbasinrast,
-              use='cat', overwrite=True, quiet=True)
+        # subbasins vector file info and attribute table connection
+        self.subbasinsvect = grass.find_file(self.subbasins, element='vector')
+        self.subbasinsdb = grass.vector_db(self.subbasins)[1]
 
-        # mask only subbasins
-        grun('r.mask',rast=self.subbasinrast,quiet=True,overwrite=True)
+        # get region/resolution once
+        self.region = grass.region()
+        # max__accum is calculated on first use
+        self._max_accum_computed = False
+
+        # make rast from subbasin vector, unless an up-to-date one exists
+        self.subbasinrast='subbasin__rast'
+        if self.r or not self.subbasinRastUpToDate():
+            grun('v.to.rast',input=self.subbasins,output=self.subbasinrast,
+                  use='cat', overwrite=True, quiet=True)
+            # mark origin to only reuse it for the same vector
+            grun('r.support',map=self.subbasinrast,title=self.subbasinRastTitle(),
+                 quiet=True)
+        else:
+            gm('Using existing %s.' % self.subbasinrast)
+
+        # mask only subbasins if requested, all zonal statistics are based on
+        # the subbasin raster, so results are the same without
+        if self.m:
+            grun('r.mask',rast=self.subbasinrast,quiet=True,overwrite=True)
 
         # decide if any parameter for the functions missing or if needed at all
         # channel width and depth
@@ -517,11 +554,29 @@ class main:
 
             # only if chl and chs is empty, make proper mainstream rast
             self.mainstreamrast = self.makeMainStreamRast()
-
-        # get current environment
-        self.env = grass.gisenv()
         return
 
+    def subbasinRastTitle(self):
+        '''Title marking subbasinrast as rasterized cats of self.subbasins'''
+        return 'm.swim.substats: v.to.rast input=%s use=cat' % self.subbasinsvect['fullname']
+
+    def subbasinRastUpToDate(self):
+        '''Check if subbasinrast exists in the current mapset, was made by
+        m.swim.substats from the subbasins vector cats, is newer than the
+        vector and matches the current region'''
+        rast = grass.find_file(self.subbasinrast, element='cell', mapset='.')
+        if not rast['file']:
+            return False
+        info = grass.raster_info(self.subbasinrast)
+        if info['title'].strip('"') != self.subbasinRastTitle():
+            return False
+        vtime = os.path.getmtime(os.path.join(self.subbasinsvect['file'], 'head'))
+        if os.path.getmtime(rast['file']) < vtime:
+            return False
+        keys = [('north','n'),('south','s'),('east','e'),('west','w'),
+                ('nsres','nsres'),('ewres','ewres')]
+        return all([info[ki] == self.region[kr] for ki, kr in keys])
+
     def subbasinStats(self):
         '''Calculate all subbasin stats for the Sub/ files, defaults and list of
         parameters given in 'swim_defaults.py that needs to be importable,
@@ -533,6 +588,14 @@ class main:
         subbfractions   = self.areaFractions()
         self.nsubbasins = len(subbfractions)
 
+        # average all parameter rasters over the subbasins concurrently
+        rasters = set([self.options[p] for f in self.orders for p in self.orders[f]
+                       if p!='flu' and p in self.options and not isNumber(self.options[p])])
+        for r in rasters:
+            if not grass.find_file(r)['name']:
+                grass.fatal('%s not found.' % r)
+        self.meanvalues = self.meanSubbasins(rasters)
+
         params = {'flu':subbfractions} # will be filled with all others
         for f in self.orders.keys():
             for p in self.orders[f]:
@@ -559,14 +622,12 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
                 stats = float(self.options[param])*np.ones(self.nsubbasins)
                 grass.message( 'Using default value for %s = %s' %(param,stats[0]))
             except ValueError:  # map name given
-                if not grass.find_file(self.options[param])['name']:
-                    grass.fatal('%s not found.' % self.options[param])
                 grass.message('Will use average subbasin values of %s for %s.'
                               % (self.options[param], param))
                 # upload mean values to subbasins table
-                rastname = self.meanSubbasin(self.options[param])
-                stats    = self.upload2Subbasins(rastname,
-                                column=self.options[param].split('@')[0])
+                stats = self.meanvalues[self.options[param]]
+                self.updateSubbasinTable(self.subbasinids,
+                                         **{self.options[param].split('@')[0]: stats})
 
         else: # try to calculate it
             stats = self.functions[param]() # call the respective function
@@ -575,16 +636,15 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
             # correct channelLength
             if param=='chl': stats = self.correctChannelLength()
         # report statistics
-        nn = ~np.isnan(stats)
-        nnans = len(np.where(~nn)[0])
+        nnans = int(np.isnan(stats).sum())
         gm("%s statistics:" % param)
         gm("min: %s mean: %s max: %s number of nans: %s" %
-           (np.min(stats[nn]), np.mean(stats[nn]), np.max(stats[nn]), nnans))
+           (np.nanmin(stats), np.nanmean(stats), np.nanmax(stats), nnans))
         return stats
 
     def meanSubbasin(self,raster, method='average'):
-        '''Upload mean value of raster to the table of self.subbasins and return
-        values as array.
+        '''Aggregate raster over each subbasin with method (r.stats.zonal) and
+        return the name of the resulting raster.
         '''
         base = self.subbasinrast
         tmpname='%s__%s__%s' %(base.split('@')[0],raster.split('@')[0],method)
@@ -594,19 +654,48 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         grass.message('%s of %s over each %s saved in %s' %(method,raster,base,tmpname))
         return tmpname
 
+    def zonalMean(self, raster):
+        '''Return the mean of raster in each subbasin as array sorted by
+        subbasin ids (nan if the subbasin has no values)'''
+        tbl = pipeParse(lambda f: pd.read_csv(f, sep='|', usecols=['zone', 'mean'],
+                                              index_col='zone', na_values=['nan', '-nan']),
+                        'r.univar', map=raster, zones=self.subbasinrast, flags='t',
+                        separator='pipe')
+        return tbl['mean'].reindex(self.subbasinids).values.astype(float)
+
+    def meanSubbasins(self, rasters):
+        '''Run zonalMean for several rasters in parallel GRASS processes and
+        return a dictionary of raster: array of subbasin means.
+        '''
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            jobs = dict([(r, pool.submit(self.zonalMean, r)) for r in rasters])
+        return dict([(r, jobs[r].result()) for r in jobs])
+
     def upload2Subbasins(self, raster, column):
-        '''Upload the values given in raster at the centroids to the subbasins
-        table and return them as array (sorted by subbasins cats/subbasinID'''
-        # upload to vector
-        grun('v.db.addcolumn',map=self.subbasins,columns=column+' double precision')
-        grun('v.what.rast', map=self.subbasins, raster=raster, column=column,
-             type='centroid',quiet=True)
+        '''Upload the values given in raster (constant within each subbasin) to
+        the subbasins table and return them as array (sorted by subbasins cats/subbasinID'''
+        # get the value of each subbasin as its zonal mean
+        stats = self.zonalMean(raster)
 
-        # get column out of table
-        stats=getTable(self.subbasins,dtype=float,
-                       columns='subbasinID,%s' %column)[column]
+        # upload to vector
+        self.updateSubbasinTable(self.subbasinids, **{column: stats})
         return stats
 
+    def updateSubbasinTable(self, ids, **columns):
+        '''Add/update double precision columns (given as arrays ordered like
+        ids) in the subbasins table with a single db.execute transaction'''
+        grun('v.db.addcolumn',map=self.subbasins,
+             columns=','.join([c+' double precision' for c in columns]))
+        db = self.subbasinsdb
+        sqlval = lambda v: 'NULL' if np.isnan(v) else repr(float(v))
+        sql = ['UPDATE %s SET %s WHERE %s=%s;' % (db['table'],
+               ','.join(['%s=%s' % (c, sqlval(columns[c][n])) for c in columns]),
+               db['key'], i) for n, i in enumerate(ids)]
+        # db.execute runs all statements in one transaction
+        grass.write_command('db.execute', input='-', database=db['database'],
+                            driver=db['driver'], stdin='\n'.join(sql))
+        return
+
     def makeMainStreamRast(self):
         # make stream rast with subbasin categories
         streamrast='%s__rast' %self.mainstreams.split('@')[0]
@@ -628,6 +717,7 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
     def areaFractions(self):
         '''Calculate the fractions for each subbasin of the entire catchment'''
         subbcells=rstats(self.subbasinrast,flags='cn')
+        self.subbasinids = subbcells['id']
         fraction = np.float64(subbcells['value'])/np.sum(subbcells['value'])
         # report stats
         v = fraction
@@ -637,22 +727,22 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         return fraction
 
     def centroid_latitude(self):
-        centroids = 'subbasin__centroids'
-        grass.run_command('v.extract', input=self.subbasins, type='centroid',
-                          output=centroids, flags='t', quiet=True, overwrite=True)
-        tmpdir = grass.tempdir()
-        tmploc = 'lonlat'
-        grass.core.create_location(tmpdir, tmploc, epsg=4326)
-        grass.run_command('g.mapset', mapset='PERMANENT', location=tmploc,
-                          dbase=tmpdir, quiet=True)
-        grass.run_command('v.proj', input=centroids, mapset=self.env['MAPSET'],
-                          location=self.env['LOCATION_NAME'],
-                          dbase=self.env['GISDBASE'], quiet=True)
-        tbl = grass.read_command('v.report', map=centroids, option='coor')
-        lat = np.array([l.split('|')[2] for l in tbl.split()[1:]], dtype=float)
-        grass.run_command('g.mapset', mapset=self.env['MAPSET'],
-                          location=self.env['LOCATION_NAME'],
-                          dbase=self.env['GISDBASE'], quiet=True)
+        '''Latitude of the subbasin centroids sorted by subbasin cats, lon/lat
+        are also uploaded to the subbasins table'''
+        try:
+            import pyproj
+        except ModuleNotFoundError:
+            raise ImportError('Cant import pyproj. Is it installed?')
+        # columns: x, y, (z for 3D vectors,) cat
+        xyc = pipeParse(lambda f: np.loadtxt(f, delimiter='|', ndmin=2),
+                        'v.out.ascii', input=self.subbasins, type='centroid',
+                        format='point', separator='pipe')
+        xyc = xyc[np.argsort(xyc[:, -1])]
+        srccrs = pyproj.CRS.from_wkt(gread('g.proj', flags='wf').strip())
+        trans = pyproj.Transformer.from_crs(srccrs, 'EPSG:4326', always_xy=True)
+        lon, lat = trans.transform(xyc[:, 0], xyc[:, 1])
+        # also keep them in the subbasin table
+        self.updateSubbasinTable(xyc[:, -1].astype(int), lon=lon, lat=lat)
         return lat
 
     def mainChannelLength(self,rasterout='mainChannelLength'):
@@ -660,28 +750,21 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         for the subbasins'''
         grass.message('Calculating main channel length...')
 
-        # make drainage direction weighted cell length
-        grass.mapcalc("drainage__abs=abs({d})".format(d=self.drainage), overwrite=True)
-        streaminfo = rinfo(self.mainstreamrast)
-        ewres, nsres = streaminfo['ewres'],streaminfo['nsres']
-        exp = "'cell__len'=if(isnull('{streams}'),null(),"
-        exp+= "if('{d}'==4 || '{d}'==8, {ew},0)+if('{d}' == 2 || '{d}' == 6,{ns},0)"
-        exp+= "+if(%s,{dia},0))"%(" || ".join(["'{d}' == %s" %i for i in [1,3,5,7]]))
-        exp = exp.format(d='drainage__abs',streams=self.mainstreamrast,ew=ewres,ns=nsres,
-                         dia=np.sqrt(float(ewres)**2+float(nsres)**2))
-        grass.mapcalc(exp, overwrite=True)
-
-        # report the sum of the cell length in the subbasins
-        grun('r.stats.zonal',base=self.mainstreamrast,cover='cell__len',
-             method='sum',output='cell__len__mainstreams__m',overwrite=True,quiet=True)
-
-        # convert to km
-        exp='cell__len__mainstreams=cell__len__mainstreams__m*0.001'
-        grass.mapcalc(exp=exp, overwrite=True)
-        # upload and get values
-        lengthrast = self.meanSubbasin('cell__len__mainstreams')
-        # change name to preserve raster
-        grun('g.rename',rast=lengthrast+','+rasterout,quiet=True,overwrite=True)
+        # make drainage direction weighted cell length in km in memory
+        drainage = garray.array(dtype=np.int32)
+        # null drainage as a value that is no valid direction
+        drainage.read(self.drainage, null=-9999)
+        streams = garray.array(dtype=np.int32)
+        streams.read(self.mainstreamrast, null=0)
+        celllen = garray.array(dtype=np.float64)
+        cellLength(np.asarray(drainage), np.asarray(streams), self.region['ewres'],
+                   self.region['nsres'], np.asarray(celllen), nodata=-1)
+        celllen.write('cell__len__km', null=-1, overwrite=True)
+        del drainage, streams, celllen
+
+        # sum of the cell length in the subbasins (stream cells only, others are null)
+        grun('r.stats.zonal',base=self.subbasinrast,cover='cell__len__km',
+             method='sum',output=rasterout,overwrite=True,quiet=True)
         # set attributed for correction
         self.chl = rasterout
 
@@ -700,7 +783,7 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         nolength = tbl[np.isnan(tbl[self.chl])]['subbasinID']
         if len(nolength)>0:
             where  = 'subbasinID IN (%s)' %(','.join(map(str,nolength)))
-            res      = grass.region()['ewres']*1e-3 # m to km
+            res      = self.region['ewres']*1e-3 # m to km
             grun('v.db.update', map=self.subbasins, column=self.chl,
                  value=res, where=where,quiet=True)
             gm('%s subbasins have a minimum main channel length of %skm:' %(len(nolength),res))
@@ -729,9 +812,13 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         '''Calculate main channel slope from the DEM and the streams'''
         grass.message('Calculating main channel slope...')
 
-        # make slope
+        # make slope from elevation within the subbasins only, so that cells on
+        # the catchment edge get no slope (as with the subbasin mask)
+        elevrast='%s__subbasins' %self.elevation.split('@')[0]
+        grass.mapcalc("'{0}'=if(isnull('{1}'),null(),'{2}')".format(elevrast,
+                      self.subbasinrast,self.elevation), overwrite=True)
         sloperast='%s__slope' %self.elevation.split('@')[0]
-        grun('r.slope.aspect',elevation=self.elevation,slope=sloperast,
+        grun('r.slope.aspect',elevation=elevrast,slope=sloperast,
              format='degrees',overwrite=True)
 
         # get mean values over main channels
@@ -751,6 +838,15 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
 
         return rasterout
 
+    def _ensure_max_accum(self):
+        '''Calculate the maximum accumulation in each subbasin (max__accum)
+        only once for channelWidth and channelDepth'''
+        if not self._max_accum_computed:
+            grun('r.stats.zonal',base=self.subbasinrast,cover=self.accumulation,
+                 method='max',output='max__accum',overwrite=True,quiet=True)
+            self._max_accum_computed = True
+        return 'max__accum'
+
     def channelWidth(self,maxwidth = 3000,rasterout='channelWidth'):
         '''Calculate the mean channel width for each subbasin given with the drainage
         area / max accumulation according to an empirical approach:
@@ -760,11 +856,10 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         '''
         grass.message('Calculating main channel width...')
         # get the maximum accumulation from the accumulation map
-        grun('r.stats.zonal',base=self.subbasinrast,cover=self.accumulation,
-             method='max',output='max__accum',overwrite=True,quiet=True)
-        res = rinfo(self.accumulation)['ewres']
+        maxaccum = self._ensure_max_accum()
+        res = self.region['ewres']
         # calculate width
-        exp=rasterout+'=min(1.29 * (max__accum * (%s^2)/1000000)^0.6, %s)' %(res,maxwidth)
+        exp=rasterout+'=min(1.29 * (%s * (%s^2)/1000000)^0.6, %s)' %(maxaccum,res,maxwidth)
         grass.mapcalc(exp, overwrite=True)
 
         return rasterout
@@ -778,11 +873,10 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
         '''
         grass.message('Calculating main channel depth...')
         # get the maximum accumulation from the accumulation map
-        grun('r.stats.zonal',base=self.subbasinrast,cover=self.accumulation,
-             method='max',output='max__accum',overwrite=True,quiet=True)
-        res = rinfo(self.accumulation)['ewres']
+        maxaccum = self._ensure_max_accum()
+        res = self.region['ewres']
         # calculate width
-        exp = rasterout+'=min(0.13 * (max__accum * (%s^2) / 1000000)^0.4, %s)' %(res,maxdepth)
+        exp = rasterout+'=min(0.13 * (%s * (%s^2) / 1000000)^0.4, %s)' %(maxaccum,res,maxdepth)
         grass.mapcalc(exp,overwrite=True)
 
         return rasterout
@@ -790,61 +884,122 @@ Can only find/calculate %s values for %s, but there are %s subbasins.""" %(len(p
     def write_csv_output(self,data):
         '''Creates or overwrites files in the subpath with the
         .sub, .rte and .gw files from the data given and the structure given in parameters'''
-        tbl = np.column_stack([np.arange(1, self.nsubbasins+1)] +
-                               [data[c] for p in sorted(self.orders)[::-1] for c in self.orders[p]])
-        cols = [s for p in sorted(self.orders)[::-1] for s in self.orders[p]]
-        mswim.inout.write_csv(self.output, tbl, ['subbasin_id'] + cols, float_precision=5,
-                           float_columns=set(cols)-set(["catchment_id"]))
+        # parameter columns in file order (subbasin, routing, groundwater)
+        ordered_cols = [c for p in sorted(self.orders, reverse=True) for c in self.orders[p]]
+        cols = ['subbasin_id'] + ordered_cols
+        # fill preallocated output array column by column
+        tbl = np.empty((self.nsubbasins, len(cols)), dtype=np.float64)
+        tbl[:, 0] = np.arange(1, self.nsubbasins+1)
+        for i, c in enumerate(ordered_cols, start=1):
+            tbl[:, i] = data[c]
+        mswim.inout.write_csv(self.output, tbl, cols, float_precision=5,
+                           float_columns=set(ordered_cols)-set(["catchment_id"]))
         grass.message('Wrote %s' %self.output)
         return
 
+def cellLength(drainage, streams, ewres, nsres, out, nodata=0):
+    '''Fill out with the drainage direction weighted length in km of all stream
+    cells (streams != 0), all other cells and stream cells without a valid
+    drainage direction (1-8, e.g. 0 or null) are set to nodata'''
+    if numba:
+        _cellLengthKernel(drainage, streams, ewres, nsres, nodata, out)
+        return out
+    # fill in place with boolean masks only, no float temporaries
+    out.fill(nodata)
+    isstream = streams != 0
+    diag = np.sqrt(ewres**2 + nsres**2)
+    for dirs, length in [((4, 8), ewres), ((2, 6), nsres), ((1, 3, 5, 7), diag)]:
+        for d in dirs:
+            out[((drainage == d) | (drainage == -d)) & isstream] = length*0.001
+    return out
+
+if numba:
+    @numba.njit(parallel=True, cache=True)
+    def _cellLengthKernel(drainage, streams, ewres, nsres, nodata, out):
+        diag = np.sqrt(ewres**2 + nsres**2)
+        for i in numba.prange(drainage.shape[0]):
+            for j in range(drainage.shape[1]):
+                d = abs(drainage[i, j])
+                if streams[i, j] == 0:
+                    out[i, j] = nodata
+                elif d == 4 or d == 8:
+                    out[i, j] = ewres*0.001
+                elif d == 2 or d == 6:
+                    out[i, j] = nsres*0.001
+                elif d == 1 or d == 3 or d == 5 or d == 7:
+                    out[i, j] = diag*0.001
+                else:
+                    out[i, j] = nodata
+
+def pipeParse(parser, module, **kw):
+    '''Run a GRASS module, parse its stdout with parser(fileobject) and return
+    the result, fatal if the module fails (its error message is shown on stderr)'''
+    proc = grass.pipe_command(module, **kw)
+    try:
+        result = parser(proc.stdout)
+    except Exception:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            grass.fatal('%s failed.' % module)
+        raise
+    if proc.wait() != 0:
+        grass.fatal('%s failed.' % module)
+    return result
+
 def rstats(rast,flags='n'):
     '''Return r.stats output as a sorted array'''
-    values=grass.parse_command('r.stats',input=rast,flags=flags,separator='=')
-    array = np.array(list(zip(values.keys(), values.values())),
-                     dtype=[('id', int), ('value', float)])
+    values = pipeParse(lambda f: np.loadtxt(f, ndmin=2),
+                       'r.stats',input=rast,flags=flags,separator='space')
+    array = np.empty(len(values), dtype=[('id', int), ('value', float)])
+    array['id'] = values[:, 0]
+    # only ids are returned without c/a/p flags
+    array['value'] = values[:, 1] if values.shape[1] > 1 else np.nan
     array.sort(order='id')
     return array
 
-def rinfo(rast):
-    return grass.parse_command('r.info',map=rast,flags='ge')
 def runivar(rast):
     return grass.parse_command('r.univar',map=rast,flags='g')
 
+def isNumber(value):
+    '''Return True if value can be converted to float'''
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
 
 def getTable(vector, dtype='U250', **kw):
     '''Get a vector table into a numpy field array, dtype can either be one
     for all or a list for each column'''
-    tbl = grass.vector_db_select(vector,**kw)
-    cols = tbl['columns']
-    values = [tuple(row) for row in tbl['values'].values()]
+    # parse all as strings first straight from the pipe, empty cells become nan
+    tbl = pipeParse(lambda f: pd.read_csv(f, sep='|', dtype=str, na_values=[''],
+                                          keep_default_na=False),
+                    'v.db.select', map=vector, separator='pipe', **kw)
+    cols = list(tbl.columns)
     dtypes = {}
     if type(dtype) not in [list,tuple]:
-        dtypes.update(dict(zip(cols,[dtype]*len(tbl['columns']))))
+        dtypes.update(dict(zip(cols,[dtype]*len(cols))))
     elif len(dtype)!=len(cols):
         raise IOError('count of dtype doesnt match the columns!')
     else:
         dtypes.update(dict(zip(cols,dtype)))
 
-    # first check for empty entries
-    tbl = np.array(values, dtype=list(zip(cols, ['U250']*len(cols))))
-    convertedvals = []
+    # convert numeric columns, empty (or invalid) cells become nan
     for c in cols:
-        i = tbl[c] == u''
-        if len(tbl[c][i]) > 0:
+        if dtypes[c] in [float,int]:
+            tbl[c] = pd.to_numeric(tbl[c], errors='coerce')
+        nempty = tbl[c].isna().sum()
+        if nempty > 0:
             grass.warning('Column %s has %s empty cells, will be parsed as '
-                          'float.' % (c, len(tbl[c][i])))
+                          'float.' % (c, nempty))
             if dtypes[c] in [float,int]:
                 dtypes[c]=float
-                tbl[c][i]='nan'
-        # actual type conversion
-        convertedvals += [np.array(tbl[c],dtype=dtypes[c])]
-    # now properly make it
-    tbl = np.array(list(zip(*convertedvals)),
-                   dtype=[(c, dtypes[c]) for c in cols])
-    # now set nans
-    #for c in ix: tbl[c][ix[c]]=np.nan
-    return tbl
+            else:
+                tbl[c] = tbl[c].fillna('')
+    # actual type conversion
+    tbl = tbl.astype(dtypes)
+    return tbl.to_records(index=False, column_dtypes=dtypes)
 
 
 if __name__=='__main__':
@@ -855,6 +1010,11 @@ if __name__=='__main__':
     grass.message('GIS Environment:\n'+fmt(grass.gisenv()))
     grass.message('Parameters:\n'+fmt(o)+fmt(f))
 
+    try:
+        import pandas as pd
+    except ModuleNotFoundError:
+        raise ImportError('Cant import pandas. Is it installed?')
+
     # send all to main
     keywords = o; keywords.update(f)
     main=main(**keywords)
@@ -867,7 +1027,8 @@ if __name__=='__main__':
     main.write_csv_output(data)
 
     # clean
-    grun('r.mask',flags='r')
+    if main.m:
+        grun('r.mask',flags='r')
     if not main.k:
         grass.run_command('g.remove',type='raster,vector', pattern='*__*',flags='fb',quiet=True)
 